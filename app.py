@@ -80,24 +80,103 @@
 
 
 import os
-import tempfile
+import hashlib
+import shutil
+import threading
+import time
+from collections import OrderedDict
 from flask import Flask, render_template, request, redirect, url_for, flash
-from chatbot_functions import process_pdf, process_website, process_word_document, initialize_rag_pipeline, rag_pipeline
+from chatbot_functions import CACHE_DIR, ensure_private_dir, process_pdf_bytes, process_website, process_word_document_bytes, initialize_rag_pipeline, load_rag_pipeline, save_vectorstore, rag_pipeline
 
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = "supersecretkey"  # Required for flashing messages
 
-# Temporary storage for the chatbot pipeline
-qa_pipeline = None
-vectorstore = None
-
-# Create a temporary directory for file uploads
-UPLOAD_FOLDER = tempfile.mkdtemp()
+# Temporary storage for the chatbot pipeline: a (qa_pipeline, vectorstore) tuple that is
+# only ever replaced whole, so each request reads one consistent snapshot without locking
+_state = None
+_state_lock = threading.Lock()
+
+# Recently used pipelines keyed by SHA-256 of the document bytes (or URL), backed by
+# vectorstores saved on disk so re-uploads skip embedding even after a restart
+INDEX_CACHE_SIZE = 8
+INDEX_DISK_CACHE_SIZE = 32  # Saved vectorstores kept on disk; the least recently written are deleted
+INDEX_CACHE_FOLDER = os.path.join(CACHE_DIR, "indexes")
+ensure_private_dir(INDEX_CACHE_FOLDER)
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+# Builds of the same document are serialized so concurrent uploads embed it only once
+_build_locks = [threading.Lock() for _ in range(64)]
+
+def cached_pipeline(key):
+    """Returns the in-memory pipeline for a document hash, or None."""
+    with _index_cache_lock:
+        if key in _index_cache:
+            _index_cache.move_to_end(key)
+            return _index_cache[key]
+    return None
+
+def get_pipeline(key, load_texts):
+    """Returns the cached pipeline for a document hash, building it from load_texts() on a miss."""
+    pipeline = cached_pipeline(key)
+    if pipeline is not None:
+        return pipeline
+
+    with _build_locks[int(key[:8], 16) % len(_build_locks)]:
+        # Another request may have built it while this one waited for the lock
+        pipeline = cached_pipeline(key)
+        if pipeline is not None:
+            return pipeline
+
+        path = os.path.join(INDEX_CACHE_FOLDER, key)
+        if os.path.isdir(path):
+            try:
+                pipeline = load_rag_pipeline(path)
+            except Exception as e:
+                print(f"Error loading the cached index {path}, rebuilding it: {e}")
+        if pipeline is None:
+            pipeline = initialize_rag_pipeline(load_texts())
+            # The pipeline is usable even if it cannot be written to the disk cache
+            try:
+                save_vectorstore(pipeline[1], path)
+                prune_index_folder()
+            except Exception as e:
+                print(f"Error saving the cached index {path}: {e}")
+
+        with _index_cache_lock:
+            _index_cache[key] = pipeline
+            if len(_index_cache) > INDEX_CACHE_SIZE:
+                _index_cache.popitem(last=False)
+    return pipeline
+
+def saved_index_paths():
+    """Returns the saved vectorstore directories, least recently written first."""
+    if not os.path.isdir(INDEX_CACHE_FOLDER):
+        return []
+    entries = [entry for entry in os.scandir(INDEX_CACHE_FOLDER) if entry.is_dir() and ".tmp-" not in entry.name]
+    return [entry.path for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime)]
+
+def prune_index_folder():
+    """Deletes saved vectorstores beyond INDEX_DISK_CACHE_SIZE and leftovers of interrupted saves."""
+    for path in saved_index_paths()[:-INDEX_DISK_CACHE_SIZE]:
+        shutil.rmtree(path, ignore_errors=True)
+    for entry in os.scandir(INDEX_CACHE_FOLDER):
+        if ".tmp-" in entry.name and time.time() - entry.stat().st_mtime > 3600:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+def warm_index_cache():
+    """Reloads the most recently saved vectorstores into the index cache."""
+    for path in saved_index_paths()[-INDEX_CACHE_SIZE:]:
+        try:
+            _index_cache[os.path.basename(path)] = load_rag_pipeline(path)
+        except Exception as e:
+            print(f"Error loading the cached index {path}: {e}")
+
+warm_index_cache()
 
 @app.route("/", methods=["GET", "POST"])
 def index():
-    global qa_pipeline, vectorstore
+    global _state
 
     if request.method == "POST":
         # Check if a file or URL was provided
@@ -109,33 +188,32 @@ def index():
                 flash("Unsupported file type. Please upload a PDF or Word document.")
                 return redirect(url_for("index"))
 
-            # Save the file temporarily
-            file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-            file.save(file_path)
+            # Read the upload once; it is hashed and processed in memory
+            data = file.stream.read()
+            key = hashlib.sha256(data).hexdigest()
 
             # Process the file based on its type
             if file.filename.endswith(".pdf"):
-                texts = process_pdf(file_path)
+                load_texts = lambda: process_pdf_bytes(data, file.filename)
             else:
-                texts = process_word_document(file_path)
+                load_texts = lambda: process_word_document_bytes(data, file.filename)
 
             # Initialize the RAG pipeline
-            qa_pipeline, vectorstore = initialize_rag_pipeline(texts)
+            pipeline = get_pipeline(key, load_texts)
+            with _state_lock:
+                _state = pipeline
             flash("Document processed successfully. You can now ask questions.")
 
-            # Delete the file after processing
-            os.remove(file_path)
-
         elif url_or_file:  # URL input
             if not url_or_file.startswith(("http://", "https://")):
                 flash("Please enter a valid URL.")
                 return redirect(url_for("index"))
 
-            # Process the website
-            texts = process_website(url_or_file)
-
-            # Initialize the RAG pipeline
-            qa_pipeline, vectorstore = initialize_rag_pipeline(texts)
+            # Process the website and initialize the RAG pipeline
+            key = hashlib.sha256(url_or_file.encode()).hexdigest()
+            pipeline = get_pipeline(key, lambda: process_website(url_or_file))
+            with _state_lock:
+                _state = pipeline
             flash("Document processed successfully. You can now ask questions.")
 
         else:
@@ -146,11 +224,11 @@ def index():
 
 @app.route("/ask", methods=["POST"])
 def ask():
-    global qa_pipeline, vectorstore
-
-    if not qa_pipeline or not vectorstore:
+    state = _state
+    if state is None:
         flash("Please upload a document or enter a URL first.")
         return redirect(url_for("index"))
+    qa_pipeline, vectorstore = state
 
     user_query = request.form["query"]
     if not user_query:
@@ -163,12 +241,13 @@ def ask():
 
 @app.route("/clear", methods=["POST"])
 def clear():
-    global qa_pipeline, vectorstore
-    qa_pipeline = None
-    vectorstore = None
+    global _state
+    with _state_lock:
+        _state = None
     flash("Session cleared. Please upload a new document or enter a URL.")
     return redirect(url_for("index"))
 
 if __name__ == "__main__":
-    # Run the Flask app
-    app.run(debug=True)
\ No newline at end of file
+    # Development server only (set FLASK_DEBUG=1 for the debugger); production runs
+    # under gunicorn with the settings in gunicorn.conf.py
+    app.run()
\ No newline at end of file
@@ -1,11 +1,29 @@
+import io
 import os
+import multiprocessing
+import atexit
+import hashlib
+import hmac
+import pickle
+import shutil
+import stat
+import uuid
+import threading
+import time
+import weakref
+import zipfile
 import requests
-import fitz  # For PDF processing
+from requests.adapters import HTTPAdapter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import numpy as np
+import faiss
+from numba import njit
+from pdf_worker import open_pdf, read_pdf_page, read_pdf_pages
 from bs4 import BeautifulSoup  # For website scraping
-from docx import Document as DocxDocument  # For Word document processing
-from langchain.text_splitter import CharacterTextSplitter
+from lxml import etree
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from langchain.memory import ConversationBufferMemory
@@ -21,19 +39,189 @@ CHUNK_OVERLAP = 50
 MAX_TOKENS = 15000
 MODEL_NAME = "gemini-2.0-flash"  # Google's model name
 TEMPERATURE = 0.4
+BATCH_SIZE = 100  # Texts per embedding request (embedding-001 accepts up to 100)
+EMBEDDING_WORKERS = 4  # Embedding requests in flight at once
+EMBEDDING_MODEL = "models/embedding-001"
+RETRIEVAL_K = 4  # Chunks passed to the LLM as context for each query
+HNSW_M = 32  # Neighbours per node in the HNSW graph
+HNSW_EF_CONSTRUCTION = 200  # Build-time search depth; higher gives a better graph
+HNSW_EF_SEARCH = 64  # Query-time search depth; higher trades speed for recall
+IVFPQ_MIN_VECTORS = 10000  # Corpora at least this large are product-quantized
+IVFPQ_SUBQUANTIZERS = 48  # Bytes per compressed vector; must divide the embedding dimension
+IVFPQ_BITS = 8
+IVFPQ_NPROBE = 16  # Inverted lists scanned per query; higher trades speed for recall
+SEMANTIC_CACHE_THRESHOLD = 0.92  # Minimum cosine similarity for reusing a cached answer
+SEMANTIC_CACHE_SIZE = 1000  # Answers kept; the oldest are evicted first
+SEMANTIC_CACHE_SAVE_INTERVAL = 60  # Minimum seconds between writes of the cache to disk
+FETCH_TIMEOUT = 10  # Seconds before a website request is abandoned
+FETCH_WORKERS = 32  # Pages fetched concurrently
+STREAMING_HTML_THRESHOLD = 1024 * 1024  # Pages larger than this (bytes) are stream-parsed
+PDF_PARALLEL_MIN_PAGES = 100  # Smaller PDFs are read in-process; worker start-up would dominate
+PDF_WORKERS = os.cpu_count() or 1
+# Saved vectorstores and the semantic cache are pickles, so they live in a private,
+# app-owned directory rather than the shared system temp dir
+CACHE_DIR = os.getenv("PARSEBOT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "parsebot"))
+SEMANTIC_CACHE_PATH = os.path.join(CACHE_DIR, "semantic_cache.pkl")
 
 # Set up Google API key
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if not GOOGLE_API_KEY:
     raise ValueError("Please set the GOOGLE_API_KEY in the .env file.")
 
+# Shared Google clients, created once instead of on every upload and query
+_EMBEDDINGS = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+_LLM = ChatGoogleGenerativeAI(model=MODEL_NAME, temperature=TEMPERATURE, max_tokens=MAX_TOKENS)
+
+
+# ================== Cache Storage ==================
+def ensure_private_dir(path):
+    """Creates a directory only this user can access, or checks that an existing one is."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise ValueError(f"The cache directory {path} must be a directory owned by the current user.")
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+
+def load_cache_key():
+    """Returns the secret used to sign cache files, creating it on first use."""
+    key_path = os.path.join(CACHE_DIR, "cache.key")
+    try:
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(key_path, "rb") as f:
+            return f.read()
+    key = os.urandom(32)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+ensure_private_dir(CACHE_DIR)
+# Cache files are only unpickled if they carry a signature made with this key, so
+# only entries this app wrote are ever loaded
+_CACHE_KEY = load_cache_key()
+
+def sign_files(*paths):
+    """Returns the HMAC-SHA256 signature of the given files' contents."""
+    mac = hmac.new(_CACHE_KEY, digestmod=hashlib.sha256)
+    for path in paths:
+        mac.update(f"{os.path.getsize(path)}:".encode())
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                mac.update(block)
+    return mac.hexdigest()
+
+
+# ================== Text Chunking ==================
+@njit(cache=True)
+def _is_space(codepoint):
+    return codepoint == 32 or (9 <= codepoint <= 13)
+
+@njit(cache=True)
+def chunk_offsets_njit(codepoints, chunk_size, overlap):
+    """Computes (start, end) offsets of overlapping chunks, preferring to cut at whitespace."""
+    n = codepoints.shape[0]
+    min_length = max(chunk_size // 2, overlap + 1)
+    offsets = np.empty((n // (min_length - overlap) + 1, 2), dtype=np.int64)
+    count = 0
+    start = 0
+    while start < n:
+        end = min(start + chunk_size, n)
+        if end < n:
+            # Back off to the last whitespace so words are not split across chunks
+            cut = end
+            while cut > start + min_length and not _is_space(codepoints[cut]):
+                cut -= 1
+            if _is_space(codepoints[cut]):
+                end = cut
+        offsets[count, 0] = start
+        offsets[count, 1] = end
+        count += 1
+        if end == n:
+            break
+        # Start the next chunk on a word boundary inside the overlap window
+        start = end - overlap
+        boundary = start
+        while boundary < end and not _is_space(codepoints[boundary - 1]):
+            boundary += 1
+        if boundary < end:
+            start = boundary
+        while start < n and _is_space(codepoints[start]):
+            start += 1
+    return offsets[:count]
+
+# Compile the kernel at import time rather than on the first upload
+chunk_offsets_njit(np.zeros(1, dtype=np.uint32), CHUNK_SIZE, CHUNK_OVERLAP)
+
+def deduplicate_lines(content, seen=None):
+    """Drops lines that repeat an earlier line, such as page headers and footers."""
+    seen = set() if seen is None else seen
+    unique = []
+    for item in content:
+        lines = []
+        for line in item.splitlines():
+            if line.strip():
+                fingerprint = hashlib.blake2b(line.strip().encode(), digest_size=8).digest()
+                if fingerprint in seen:
+                    continue
+                seen.add(fingerprint)
+            lines.append(line)
+        text = "\n".join(lines).strip()
+        if text:
+            unique.append(text)
+    return unique
+
+def split_into_chunks(content, source, seen=None):
+    """Splits extracted text into overlapping Document chunks.
+
+    Lines already in seen (or earlier in content) are left out, so boilerplate
+    repeated on every page is embedded once rather than once per chunk.
+    """
+    text = "\n\n".join(deduplicate_lines(content, seen))
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    documents = []
+    for start, end in chunk_offsets_njit(codepoints, CHUNK_SIZE, CHUNK_OVERLAP):
+        chunk = text[start:end].strip()
+        if chunk:
+            documents.append(Document(page_content=chunk, metadata={"source": source}))
+    return documents
 
 # ================== PDF Processing ==================
-def read_pdf(file_path):
-    """Reads a PDF file and extracts text content."""
+# Shared pool for reading large PDFs. Workers start from a forkserver that has only
+# imported pdf_worker, so they never inherit this process's threads or gRPC clients.
+_pdf_context = multiprocessing.get_context("forkserver")
+_pdf_context.set_forkserver_preload(["pdf_worker"])
+_PDF_POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=_pdf_context)
+
+def read_pdf_in_parallel(file_path, page_count):
+    """Extracts the text of every page of a PDF file, spread across the worker pool."""
+    # MuPDF documents cannot be shared between threads, so each worker
+    # process opens its own copy and extracts a contiguous page range
+    step = -(-page_count // PDF_WORKERS)
+    starts = list(range(0, page_count, step))
+    stops = [min(start + step, page_count) for start in starts]
+    segments = _PDF_POOL.map(read_pdf_pages, [file_path] * len(starts), starts, stops)
+    return [page for segment in segments for page in segment]
+
+def read_pdf(file):
+    """Reads a PDF file (a path or its bytes) and extracts text content."""
     try:
-        doc = fitz.open(file_path)
-        return [page.get_text().strip() for page in doc if page.get_text().strip()]
+        with open_pdf(file) as doc:
+            page_count = doc.page_count
+            if page_count < PDF_PARALLEL_MIN_PAGES:
+                # Small files are read from the document already open, without the worker pool
+                return [text for page in doc if (text := read_pdf_page(page))]
+        if isinstance(file, bytes):
+            # Write in-memory uploads to disk once so workers receive a path, not a copy of the bytes
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+                tmp.write(file)
+            try:
+                pages = read_pdf_in_parallel(tmp.name, page_count)
+            finally:
+                os.remove(tmp.name)
+        else:
+            pages = read_pdf_in_parallel(file, page_count)
+        return [page for page in pages if page]
     except Exception as e:
         print(f"Error reading the PDF file: {e}")
         return []
@@ -43,61 +231,138 @@ def process_pdf(file_path):
     content = read_pdf(file_path)
     if not content:
         raise ValueError("No content could be read from the PDF file.")
-    documents = [Document(page_content=text, metadata={"source": file_path}) for text in content]
-    text_splitter = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    return text_splitter.split_documents(documents)
+    return split_into_chunks(content, file_path)
+
+def process_pdf_bytes(pdf_bytes, source):
+    """Processes an in-memory PDF file and splits it into chunks."""
+    content = read_pdf(pdf_bytes)
+    if not content:
+        raise ValueError("No content could be read from the PDF file.")
+    return split_into_chunks(content, source)
 
 # ================== Website Processing ==================
-def scrape_website(url):
-    """Scrapes content from a website."""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+TEXT_TAGS = ('p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'span', 'div')
+TEXT_SELECTOR = ', '.join(TEXT_TAGS)
+
+# One pooled session for every scrape, so repeat visits to a host reuse its connection
+_HTTP = requests.Session()
+_HTTP.headers.update(HEADERS)
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=FETCH_WORKERS)
+_HTTP.mount('https://', _adapter)
+_HTTP.mount('http://', _adapter)
+
+def fetch_page(url):
+    """Fetches the raw bytes of a web page."""
+    response = _HTTP.get(url, timeout=FETCH_TIMEOUT)
+    response.raise_for_status()
+    return response.content
+
+def stream_website_text(html):
+    """Extracts text from a large HTML page without building a full tree."""
+    content = []
+    context = etree.iterparse(io.BytesIO(html), events=("end",), tag=TEXT_TAGS + ("script", "style"), html=True, remove_comments=True)
+    for _, elem in context:
+        if elem.tag in TEXT_TAGS:
+            # Nested matches are read with their outermost match, so inline tags stay in the enclosing text
+            if next(elem.iterancestors(*TEXT_TAGS), None) is not None:
+                continue
+            # Emit the element and each nested match in document order, as soup.select does
+            for match in elem.iter(*TEXT_TAGS):
+                text = "".join(match.itertext()).strip()
+                if text:
+                    content.append(text)
+        elem.clear(keep_tail=True)
+    
+    # If no content found, try to get all text from body
+    if not content and context.root is not None:
+        body = context.root.find('body')
+        if body is not None:
+            text = '\n'.join(line.strip() for line in body.itertext() if line.strip())
+            content = [text] if text else []
+    return content
+
+def extract_website_text(html):
+    """Extracts readable text content from an HTML page."""
+    if len(html) > STREAMING_HTML_THRESHOLD:
+        content = stream_website_text(html)
+    else:
+        soup = BeautifulSoup(html, 'lxml')
         
         # Remove script and style elements
         for script in soup(["script", "style"]):
             script.decompose()
         
         # Get text from various elements
-        content = []
-        for elem in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'span', 'div']):
-            if elem.text.strip():
-                content.append(elem.text.strip())
+        content = [text for elem in soup.select(TEXT_SELECTOR) if (text := elem.get_text().strip())]
         
         # If no content found, try to get all text from body
         if not content:
             body = soup.find('body')
             if body:
                 content = [body.get_text(separator='\n', strip=True)]
-        
-        if not content:
-            print("Warning: No content found. The website might have unusual structure or require JavaScript.")
-            return []
-        
-        return content
-    except requests.RequestException as e:
-        print(f"Error scraping the website: {e}")
-        return []
+    
+    if not content:
+        print("Warning: No content found. The website might have unusual structure or require JavaScript.")
+    return content
+
+def scrape_websites(urls):
+    """Scrapes content from several websites concurrently, one content list per URL."""
+    results = []
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(urls)) or 1) as executor:
+        for future in [executor.submit(fetch_page, url) for url in urls]:
+            try:
+                results.append(extract_website_text(future.result()))
+            except requests.RequestException as e:
+                print(f"Error scraping the website: {e}")
+                results.append([])
+    return results
+
+def scrape_website(url):
+    """Scrapes content from a website."""
+    return scrape_websites([url])[0]
 
 def process_website(url):
-    """Processes website content and splits it into chunks."""
-    content = scrape_website(url)
-    if not content:
+    """Processes website content and splits it into chunks. Accepts a URL or a list of page URLs."""
+    urls = [url] if isinstance(url, str) else list(url)
+    documents = []
+    # Navigation and footers repeat across a site's pages, so keep each line once per site
+    seen = set()
+    for page_url, content in zip(urls, scrape_websites(urls)):
+        documents.extend(split_into_chunks(content, page_url, seen))
+    if not documents:
         raise ValueError("No content could be fetched from the website.")
-    documents = [Document(page_content=text, metadata={"source": url}) for text in content]
-    text_splitter = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    return text_splitter.split_documents(documents)
+    return documents
 
 # ================== Word Document Processing ==================
-def read_word_document(file_path):
-    """Reads a Word document and extracts text content."""
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+# Run elements that stand for whitespace rather than carrying text
+WORD_BREAKS = {f'{WORD_NAMESPACE}tab': '\t', f'{WORD_NAMESPACE}br': '\n', f'{WORD_NAMESPACE}cr': '\n'}
+WORD_RUN_TAGS = (f'{WORD_NAMESPACE}t',) + tuple(WORD_BREAKS)
+
+def word_run_text(elem):
+    """Returns the text a <w:t>, <w:tab>, <w:br> or <w:cr> element contributes to its paragraph."""
+    if elem.tag not in WORD_BREAKS:
+        return elem.text or ''
+    # <w:tab> also defines tab stops under <w:pPr><w:tabs>; only those inside a run are text
+    return WORD_BREAKS[elem.tag] if elem.getparent().tag == f'{WORD_NAMESPACE}r' else ''
+
+def read_word_document(file):
+    """Reads a Word document (a path or its bytes) and extracts text content."""
     try:
-        doc = DocxDocument(file_path)
-        return [paragraph.text.strip() for paragraph in doc.paragraphs if paragraph.text.strip()]
+        if isinstance(file, bytes):
+            file = io.BytesIO(file)
+        # Stream paragraphs straight out of the document XML inside the .docx archive
+        content = []
+        with zipfile.ZipFile(file) as archive, archive.open('word/document.xml') as xml:
+            for _, paragraph in etree.iterparse(xml, tag=f'{WORD_NAMESPACE}p'):
+                text = ''.join(word_run_text(elem) for elem in paragraph.iter(*WORD_RUN_TAGS)).strip()
+                if text:
+                    content.append(text)
+                paragraph.clear()
+        return content
     except Exception as e:
         print(f"Error reading the Word document: {e}")
         return []
@@ -107,18 +372,18 @@ def process_word_document(file_path):
     content = read_word_document(file_path)
     if not content:
         raise ValueError("No content could be read from the Word document.")
-    documents = [Document(page_content=text, metadata={"source": file_path}) for text in content]
-    text_splitter = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    return text_splitter.split_documents(documents)
+    return split_into_chunks(content, file_path)
+
+def process_word_document_bytes(docx_bytes, source):
+    """Processes an in-memory Word document and splits it into chunks."""
+    content = read_word_document(docx_bytes)
+    if not content:
+        raise ValueError("No content could be read from the Word document.")
+    return split_into_chunks(content, source)
 
 # ================== RAG Pipeline ==================
-def initialize_rag_pipeline(texts):
-    """Initializes the RAG pipeline with the given texts."""
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    vectorstore = FAISS.from_documents(texts, embeddings)
-    
-    # Set up the retrieval-based QA system with a prompt template
-    template = """Context: {context}
+# Prompt template for the retrieval-based QA system, parsed once at import time
+TEMPLATE = """Context: {context}
 
 Question: {question}
 
@@ -130,26 +395,253 @@ Answer the question as human like as possible.
 
 
 """
-    PROMPT = PromptTemplate(template=template, input_variables=["context", "question"])
+_PROMPT = PromptTemplate(template=TEMPLATE, input_variables=["context", "question"])
+
+def embed_batches(contents):
+    """Yields (positions, vectors) for each BATCH_SIZE batch of texts as its embedding request completes."""
+    # Batch texts of similar length together so less of each batch is padding
+    order = sorted(range(len(contents)), key=lambda i: len(contents[i]))
+    batches = iter([order[start:start + BATCH_SIZE] for start in range(0, len(order), BATCH_SIZE)])
+    with ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS) as executor:
+        pending = {}
+        while True:
+            # Keep at most EMBEDDING_WORKERS requests in flight so finished results never pile up
+            while len(pending) < EMBEDDING_WORKERS and (batch := next(batches, None)) is not None:
+                pending[executor.submit(_EMBEDDINGS.embed_documents, [contents[i] for i in batch])] = batch
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), np.asarray(future.result(), dtype=np.float32)
+
+def embed_in_batches(contents):
+    """Embeds texts with one API request per BATCH_SIZE texts, returning vectors in input order."""
+    vectors = None
+    for positions, batch_vectors in embed_batches(contents):
+        if vectors is None:
+            vectors = np.empty((len(contents), batch_vectors.shape[1]), dtype=np.float32)
+        vectors[positions] = batch_vectors
+    return vectors
+
+def build_faiss_index(vectors):
+    """Builds an index for approximate nearest-neighbour search.
+
+    Large corpora use IVFPQ, which stores each vector in IVFPQ_SUBQUANTIZERS bytes
+    instead of 4 bytes per dimension. The compression makes distances approximate,
+    so recall drops slightly; IVFPQ_NPROBE recovers some of it at query time.
+    Smaller corpora keep full-precision vectors in an HNSW graph.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+    if count >= IVFPQ_MIN_VECTORS and dim % IVFPQ_SUBQUANTIZERS == 0:
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, int(4 * np.sqrt(count)), IVFPQ_SUBQUANTIZERS, IVFPQ_BITS)
+        index.train(vectors)
+        index.add(vectors)
+        index.nprobe = IVFPQ_NPROBE
+        return index
+
+    index = new_hnsw_index(dim)
+    index.add(vectors)
+    return index
+
+def new_hnsw_index(dim):
+    """Creates an empty HNSW index."""
+    index = faiss.IndexHNSWFlat(dim, HNSW_M)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+def build_vectorstore(texts):
+    """Embeds the chunks and indexes them in a LangChain FAISS vectorstore."""
+    contents = [doc.page_content for doc in texts]
+    if len(texts) >= IVFPQ_MIN_VECTORS:
+        # IVFPQ has to be trained on every vector before any can be added
+        index = build_faiss_index(embed_in_batches(contents))
+        positions = list(range(len(texts)))
+    else:
+        # Insert each batch into the graph while the next batches are still being embedded
+        index, positions = None, []
+        for batch, vectors in embed_batches(contents):
+            if index is None:
+                index = new_hnsw_index(vectors.shape[1])
+            index.add(vectors)
+            positions.extend(batch)
+    ids = [str(uuid.uuid4()) for _ in texts]
+    docstore = InMemoryDocstore(dict(zip(ids, texts)))
+    return FAISS(_EMBEDDINGS, index, docstore, {row: ids[i] for row, i in enumerate(positions)})
+
+def build_qa_chain(vectorstore):
+    """Builds the retrieval-based QA chain over a vectorstore."""
+    # Each chain keeps its own conversation history, so the memory cannot be shared
     memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
     
     qa = RetrievalQA.from_chain_type(
-        llm=ChatGoogleGenerativeAI(model=MODEL_NAME, temperature=TEMPERATURE, max_tokens=MAX_TOKENS),
+        llm=_LLM,
         chain_type="stuff",
-        retriever=vectorstore.as_retriever(),
+        retriever=vectorstore.as_retriever(search_kwargs={"k": RETRIEVAL_K}),
         memory=memory,
-        chain_type_kwargs={"prompt": PROMPT}
+        chain_type_kwargs={"prompt": _PROMPT}
     )
-    return qa, vectorstore
+    return qa
+
+def initialize_rag_pipeline(texts):
+    """Initializes the RAG pipeline with the given texts."""
+    vectorstore = build_vectorstore(texts)
+    return build_qa_chain(vectorstore), vectorstore
+
+def save_vectorstore(vectorstore, path):
+    """Saves a vectorstore with save_local, replacing any previous copy at path in one step."""
+    # Write into a sibling directory first so a crash or failed write never leaves a partial index at path
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    try:
+        vectorstore.save_local(tmp_path)
+        signature = sign_files(os.path.join(tmp_path, "index.faiss"), os.path.join(tmp_path, "index.pkl"))
+        with open(os.path.join(tmp_path, "signature"), "w") as f:
+            f.write(signature)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+def load_vectorstore(path):
+    """Loads a vectorstore saved with save_vectorstore, refusing files it did not sign."""
+    with open(os.path.join(path, "signature")) as f:
+        signature = f.read()
+    if not hmac.compare_digest(signature, sign_files(os.path.join(path, "index.faiss"), os.path.join(path, "index.pkl"))):
+        raise ValueError(f"The saved index at {path} was not written by this app.")
+    # Memory-map the index so its vectors are paged in from the file on demand rather
+    # than copied into the heap. IVF indexes map their inverted lists; flat and HNSW
+    # storage needs IO_FLAG_MMAP_IFC, which IO_FLAG_MMAP does not cover.
+    index_path = os.path.join(path, "index.faiss")
+    with open(index_path, "rb") as f:
+        is_ivf = f.read(4).startswith(b"Iw")
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if is_ivf else faiss.IO_FLAG_MMAP_IFC
+    index = faiss.read_index(index_path, flags)
+    # faiss saves nprobe and efSearch with the index; reapply the configured values in case they changed since it was saved
+    if is_ivf:
+        faiss.extract_index_ivf(index).nprobe = IVFPQ_NPROBE
+    elif hasattr(index, "hnsw"):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(_EMBEDDINGS, index, docstore, index_to_docstore_id)
+
+def load_rag_pipeline(path):
+    """Initializes the RAG pipeline from a vectorstore saved with save_local."""
+    vectorstore = load_vectorstore(path)
+    return build_qa_chain(vectorstore), vectorstore
+
+# ================== Semantic Cache ==================
+# Answered queries, keyed by query embedding and tagged with the corpus they were answered from
+_semantic_cache = None
+_semantic_cache_lock = threading.RLock()  # FAISS indexes cannot be searched while being added to
+_semantic_cache_save_lock = threading.Lock()  # Orders disk writes; never held with lookups waiting
+_semantic_cache_dirty = False
+_semantic_cache_saved_at = 0.0
+_corpus_keys = weakref.WeakKeyDictionary()
+
+def corpus_key(vectorstore):
+    """Returns a hash of the documents in a vectorstore, so cached answers stay per-corpus."""
+    key = _corpus_keys.get(vectorstore)
+    if key is None:
+        digest = hashlib.sha256()
+        for doc_id in vectorstore.index_to_docstore_id.values():
+            digest.update(vectorstore.docstore.search(doc_id).page_content.encode())
+            digest.update(b"\0")
+        key = _corpus_keys[vectorstore] = digest.hexdigest()
+    return key
+
+def load_semantic_cache():
+    """Loads the semantic cache persisted by a previous run, if any."""
+    global _semantic_cache
+    with _semantic_cache_lock:
+        if _semantic_cache is None and os.path.isfile(SEMANTIC_CACHE_PATH):
+            try:
+                with open(SEMANTIC_CACHE_PATH, "rb") as f:
+                    signature, data = f.read(32), f.read()
+                if not hmac.compare_digest(signature, hmac.digest(_CACHE_KEY, data, "sha256")):
+                    raise ValueError("the file was not written by this app")
+                _semantic_cache = FAISS.deserialize_from_bytes(
+                    data, _EMBEDDINGS, allow_dangerous_deserialization=True, normalize_L2=True
+                )
+            except Exception as e:
+                print(f"Error loading the semantic cache: {e}")
+        return _semantic_cache
+
+def lookup_cached_answer(query_vector, key):
+    """Returns the cached answer to a near-identical query on the same corpus, or None."""
+    with _semantic_cache_lock:
+        cache = load_semantic_cache()
+        if cache is None:
+            return None
+        matches = cache.similarity_search_with_score_by_vector(query_vector, k=1, filter={"corpus": key})
+    if not matches:
+        return None
+    doc, distance = matches[0]
+    # Vectors are unit length, so the squared L2 distance is 2 - 2 * cosine similarity
+    if 1 - distance / 2 >= SEMANTIC_CACHE_THRESHOLD:
+        return doc.metadata["answer"]
+    return None
+
+def save_semantic_cache():
+    """Writes the semantic cache to disk if it changed since the last write."""
+    global _semantic_cache_dirty, _semantic_cache_saved_at
+    with _semantic_cache_save_lock:
+        with _semantic_cache_lock:
+            if _semantic_cache is None or not _semantic_cache_dirty:
+                return
+            data = _semantic_cache.serialize_to_bytes()
+            _semantic_cache_dirty = False
+            _semantic_cache_saved_at = time.monotonic()
+        # Write outside the cache lock so lookups never wait on the disk
+        tmp_path = f"{SEMANTIC_CACHE_PATH}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(hmac.digest(_CACHE_KEY, data, "sha256"))
+            f.write(data)
+        os.replace(tmp_path, SEMANTIC_CACHE_PATH)
+
+atexit.register(save_semantic_cache)
+
+def cache_answer(query, query_vector, key, answer):
+    """Adds an answered query to the semantic cache, evicting the oldest answers beyond SEMANTIC_CACHE_SIZE."""
+    global _semantic_cache, _semantic_cache_dirty
+    metadata = {"corpus": key, "answer": answer}
+    with _semantic_cache_lock:
+        if load_semantic_cache() is None:
+            _semantic_cache = FAISS.from_embeddings(
+                [(query, query_vector)], _EMBEDDINGS, metadatas=[metadata], normalize_L2=True
+            )
+        else:
+            _semantic_cache.add_embeddings([(query, query_vector)], metadatas=[metadata])
+        # index_to_docstore_id stays in insertion order, so the oldest answers come first
+        excess = len(_semantic_cache.index_to_docstore_id) - SEMANTIC_CACHE_SIZE
+        if excess > 0:
+            _semantic_cache.delete(list(_semantic_cache.index_to_docstore_id.values())[:excess])
+        _semantic_cache_dirty = True
+        save_due = time.monotonic() - _semantic_cache_saved_at >= SEMANTIC_CACHE_SAVE_INTERVAL
+    if save_due:
+        save_semantic_cache()
 
 def rag_pipeline(query, qa_chain, vectorstore):
     """Runs the RAG pipeline to answer a query."""
-    relevant_docs = vectorstore.similarity_search_with_score(query, k=3)
+    query_vector = _EMBEDDINGS.embed_query(query)
+    key = corpus_key(vectorstore)
+    cached = lookup_cached_answer(query_vector, key)
+    if cached is not None:
+        return cached
+
+    # Retrieve with the query embedding computed above rather than letting the
+    # chain's retriever embed the query a second time
+    relevant_docs = vectorstore.similarity_search_by_vector(query_vector, k=RETRIEVAL_K)
     if not relevant_docs:
         return "I don't have enough information to answer that question."
-    context = "\n\n".join([doc.page_content for doc, _ in relevant_docs])
-    response = qa_chain.invoke({"query": query})
-    return response['result']
+    response = qa_chain.combine_documents_chain.invoke({"input_documents": relevant_docs, "question": query})
+    answer = response['output_text']
+    qa_chain.memory.save_context({"query": query}, {"result": answer})
+    cache_answer(query, query_vector, key, answer)
+    return answer
 
 # ================== Main Program ==================
 if __name__ == "__main__":
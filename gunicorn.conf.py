@@ -0,0 +1,13 @@
+# Gunicorn settings, loaded automatically by `gunicorn wsgi:app` (see Procfile)
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# The processed document lives in process memory, so run a single worker and let
+# its threads overlap the slow LLM round-trips of concurrent /ask requests
+worker_class = "gthread"
+workers = 1
+threads = 32
+
+# Keep worker heartbeat files in memory rather than on disk
+worker_tmp_dir = "/dev/shm"
@@ -0,0 +1,23 @@
+import fitz  # For PDF processing
+
+# Page extraction for chatbot_functions. This lives in its own module so the worker
+# processes that read large PDFs only import PyMuPDF, not the LangChain/Google stack.
+
+# Keep the default "blocks" extraction flags and also rejoin words hyphenated across line breaks
+PDF_TEXT_FLAGS = fitz.TEXTFLAGS_BLOCKS | fitz.TEXT_DEHYPHENATE
+
+def open_pdf(file):
+    """Opens a PDF from a file path or from the file's bytes."""
+    if isinstance(file, bytes):
+        return fitz.open(stream=file, filetype="pdf")
+    return fitz.open(file)
+
+def read_pdf_page(page):
+    """Extracts the text of a PDF page block by block."""
+    blocks = page.get_text("blocks", flags=PDF_TEXT_FLAGS)
+    return "\n".join(block[4] for block in blocks if block[6] == 0).strip()
+
+def read_pdf_pages(file, start, stop):
+    """Extracts the text of pages start..stop-1 of a PDF file."""
+    with open_pdf(file) as doc:
+        return [read_pdf_page(doc.load_page(i)) for i in range(start, stop)]